@@ -1,8 +1,7 @@
 import streamlit as st
 import pandas as pd
-import json
+import orjson
 import datetime
-import time
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
@@ -12,16 +11,32 @@ from oauth2client.service_account import ServiceAccountCredentials
 
 SCOPES = ["https://spreadsheets.google.com/feeds", 'https://www.googleapis.com/auth/drive']
 
+GAME_COLUMNS = ["game_date", "winner", "assassination_success", "roles"]
+
+# 工作表结构：标题 -> (初始行数, 表头)
+SHEET_SCHEMA = {
+    "Players": (100, ["name", "joined_at"]),
+    "Games": (1000, GAME_COLUMNS),
+}
+
 @st.cache_resource
-def get_db_connection():
+def get_credentials():
     # 从 Streamlit Secrets 读取配置
     if "gcp_service_account" not in st.secrets:
         st.error("未找到密钥配置！请在 Streamlit Cloud 的 Secrets 中配置 gcp_service_account。")
         st.stop()
         
     creds_dict = dict(st.secrets["gcp_service_account"])
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPES)
-    client = gspread.authorize(creds)
+    return ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPES)
+
+@st.cache_resource
+def get_client():
+    # 凭证和 client 全局只建一次，所有会话共用 access token 和同一个 HTTP session
+    return gspread.authorize(get_credentials())
+
+@st.cache_resource
+def get_db_connection():
+    client = get_client()
     
     # 打开你的表格，这里需要在 Secrets 里配置表格名称或 URL
     sheet_url = st.secrets["private_gsheets_url"]
@@ -29,64 +44,111 @@ def get_db_connection():
     return sh
 
 def init_db(sh):
-    # 检查并创建 Players 工作表
-    try:
-        ws_p = sh.worksheet("Players")
-    except:
-        ws_p = sh.add_worksheet(title="Players", rows=100, cols=2)
-        ws_p.append_row(["name", "joined_at"]) # 表头
-        
-    # 检查并创建 Games 工作表
-    try:
-        ws_g = sh.worksheet("Games")
-    except:
-        ws_g = sh.add_worksheet(title="Games", rows=1000, cols=4)
-        ws_g.append_row(["game_date", "winner", "assassination_success", "roles"]) # 表头
+    # 一次 metadata 请求拿到所有工作表，代替逐个 try/except 探测
+    worksheets = sh.worksheets()
+    existing_titles = {ws.title for ws in worksheets}
+    next_id = max((ws.id for ws in worksheets), default=0) + 1
+    requests = []
+    for title, (rows, header) in SHEET_SCHEMA.items():
+        if title in existing_titles:
+            continue
+        # 自己指定 sheetId，同一批次里的 updateCells 才能引用新表
+        sheet_id, next_id = next_id, next_id + 1
+        requests.append({"addSheet": {"properties": {
+            "sheetId": sheet_id, "title": title,
+            "gridProperties": {"rowCount": rows, "columnCount": len(header)},
+        }}})
+        requests.append({"updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0},
+            "rows": [{"values": [{"userEnteredValue": {"stringValue": h}} for h in header]}],
+            "fields": "userEnteredValue",
+        }})
+    if requests:
+        # 缺失的表和表头在一次 batchUpdate 里建好，原子执行
+        # （表头用 updateCells 而非 values_batch_update，否则建表后还要多一次请求）
+        sh.batch_update({"requests": requests})
+        # 重建的表 sheetId 变了，丢掉缓存里的旧句柄
+        get_ws.clear()
 
-def get_all_players():
-    sh = get_db_connection()
-    ws = sh.worksheet("Players")
-    # 获取第一列，排除表头
-    names = ws.col_values(1)
-    if len(names) > 1:
-        return names[1:]
-    return []
+# 工作表句柄跨 rerun 缓存，避免重复的 sh.worksheet() 元数据请求
+@st.cache_resource
+def get_ws(title):
+    return get_db_connection().worksheet(title)
 
-def add_new_player(name):
+@st.cache_data(ttl=300)
+def load_all_data():
     sh = get_db_connection()
-    ws = sh.worksheet("Players")
-    existing = get_all_players()
+    # 一次 batchGet 同时读取两张表（跳过表头），代替逐表请求
+    res = sh.values_batch_get(["Players!A2:B", "Games!A2:D"])
+    p_rows, g_rows = (vr.get("values", []) for vr in res["valueRanges"])
+    players = [r[0] for r in p_rows if r and r[0]]
+    # 末尾空单元格不会返回，补齐到 4 列
+    games = [(r + [""] * len(GAME_COLUMNS))[:len(GAME_COLUMNS)] for r in g_rows if r]
+    # 按日期倒序排好再缓存，渲染时不用每次重排
+    games.sort(key=lambda r: r[0], reverse=True)
+    return players, games
+
+def add_new_player(name, existing):
+    # existing 由调用方传入本次 rerun 已读取的玩家列表，避免再复制一份缓存
+    ws = get_ws("Players")
     if name in existing:
         return False
     ws.append_row([name, str(datetime.datetime.now())])
+    load_all_data.clear()
     return True
 
 def delete_player(name):
-    sh = get_db_connection()
-    ws = sh.worksheet("Players")
-    cell = ws.find(name)
-    if cell:
-        ws.delete_rows(cell.row)
+    ws = get_ws("Players")
+    # 只读 Players 第一列来定位行号，不用可能过时的缓存（表格可能被手动改过），
+    # 也不必连带下载 Games
+    names = ws.col_values(1)
+    try:
+        idx = names.index(name, 1)  # 跳过表头
+    except ValueError:
+        return
+    # col_values 下标从 0 开始，行号从 1 开始
+    ws.delete_rows(idx + 1)
+    load_all_data.clear()
 
 def save_game(game_date, winner, assassination_success, role_dict):
-    sh = get_db_connection()
-    ws = sh.worksheet("Games")
+    ws = get_ws("Games")
     date_str = game_date.strftime("%Y-%m-%d")
-    roles_json = json.dumps(role_dict, ensure_ascii=False)
-    # 写入一行
-    ws.append_row([date_str, winner, "TRUE" if assassination_success else "FALSE", roles_json])
+    # orjson 输出 UTF-8 bytes，中文不转义，与原来 ensure_ascii=False 一致
+    roles_json = orjson.dumps(role_dict).decode()
+    # 写入一行，RAW 跳过服务端的公式/类型解析
+    ws.append_row([date_str, winner, "TRUE" if assassination_success else "FALSE", roles_json],
+                  value_input_option="RAW")
+    # 清掉共享缓存，所有会话下次 rerun 都会重新读取
+    load_all_data.clear()
 
-def load_games():
-    sh = get_db_connection()
-    ws = sh.worksheet("Games")
-    data = ws.get_all_records()
-    # 转换为 DataFrame
-    df = pd.DataFrame(data)
-    # Google Sheets 有时候读出来的布尔值是字符串，处理一下
-    if not df.empty and 'assassination_success' in df.columns:
-        df['assassination_success'] = df['assassination_success'].apply(lambda x: True if str(x).upper() == 'TRUE' else False)
+def parse_roles(s):
+    # 解析失败或不是 JSON 对象的行返回空 dict，由各视图自行跳过
+    try:
+        roles = orjson.loads(s)
+    except orjson.JSONDecodeError:
+        return {}
+    return roles if isinstance(roles, dict) else {}
+
+def load_games(rows):
+    # rows 来自 load_all_data()，由调用方每次 rerun 读取一次后传入（已按日期倒序）
+    # 新表只有表头时直接返回空表，不再做后续转换
+    if not rows:
+        return pd.DataFrame(columns=GAME_COLUMNS + ["roles_dict"])
+    df = pd.DataFrame(rows, columns=GAME_COLUMNS)
+    # Google Sheets 读出来的布尔值是字符串，处理一下
+    df['assassination_success'] = df['assassination_success'].str.upper().eq('TRUE')
+    # roles 只解析一次，各 Tab 直接用 roles_dict
+    df['roles_dict'] = df['roles'].map(parse_roles)
     return df
 
+def explode_roles(df):
+    # 把每局的 {玩家: 角色} 展开成 (Player, RoleKey) 长表，索引仍指向原来那一局
+    pairs = df['roles_dict'].map(lambda d: list(d.items())).explode().dropna()
+    long = pd.DataFrame(pairs.tolist(), index=pairs.index, columns=["Player", "RoleKey"])
+    # 手改过的表格里角色可能不是字符串（数字、null），统一转成 str，和原来 f-string 拼接的效果一致
+    long["RoleKey"] = long["RoleKey"].map(str)
+    return long
+
 # --- 游戏逻辑配置 (保持 V8 逻辑) ---
 GAME_RULES = {
     5: {"good": 3, "bad": 2},
@@ -102,6 +164,13 @@ ROLE_DISPLAY = {
     "Assassin": "🗡️ 刺客", "Morgana": "😈 莫甘娜", "Mordred": "👺 莫德雷德",
     "Oberon": "👽 奥博伦", "Minion": "👿 爪牙"
 }
+# 角色 -> 中文名（去掉 emoji），表格视图的列名
+ROLE_TO_CN = {k: v.split(" ", 1)[-1] for k, v in ROLE_DISPLAY.items()}
+
+# 角色阵营分类
+BAD_ROLES = frozenset({"Assassin", "Morgana", "Mordred", "Oberon", "Minion"})
+EVIL_SPECIAL = frozenset({"Assassin", "Morgana", "Mordred", "Oberon"})
+BLUE_ROLES = frozenset({"Merlin", "Percival", "Civilian"})
 
 # --- 界面部分 (基本保持 V8，微调数据库调用) ---
 st.set_page_config(page_title="阿瓦隆助手 Cloud", page_icon="🛡️", layout="centered") 
@@ -115,11 +184,16 @@ except Exception as e:
     st.error(f"数据库连接失败，请检查 Secrets 配置。错误信息: {e}")
     st.stop()
 
+# 每次 rerun 只读取一次缓存（st.cache_data 每次调用都会复制整份数据），各 Tab 共用
+players, games = load_all_data()
+df = load_games(games)
+
 tab_input, tab_history, tab_stats = st.tabs(["📝 记一局", "📊 看战绩", "📈 个人分析"])
 
 # === Tab 1: 录入 ===
 with tab_input:
-    current_players = get_all_players()
+    current_players = players
+
     with st.expander("⚙️ 玩家管理", expanded=False):
         tab_add, tab_del = st.tabs(["➕ 添加", "🗑️ 删除"])
         with tab_add:
@@ -128,9 +202,8 @@ with tab_input:
             with c2: 
                 if st.button("添加"):
                     if new_name:
-                        if add_new_player(new_name):
-                            st.success(f"已添加 {new_name}")
-                            time.sleep(1)
+                        if add_new_player(new_name, players):
+                            st.toast(f"已添加 {new_name}", icon="✅")
                             st.rerun()
                         else:
                             st.warning("玩家已存在")
@@ -140,8 +213,7 @@ with tab_input:
                 if st.button("❌ 删除玩家", type="primary"):
                     if to_delete:
                         delete_player(to_delete)
-                        st.success("已删除")
-                        time.sleep(1)
+                        st.toast("已删除", icon="✅")
                         st.rerun()
 
     if not current_players:
@@ -195,7 +267,7 @@ with tab_input:
                 p_o = st.selectbox("👽 奥博伦", pool, index=None)
                 if p_o: role_map[p_o]="Oberon"; pool.remove(p_o)
             
-            curr_bad = sum(1 for r in role_map.values() if r in ["Assassin", "Morgana", "Mordred", "Oberon"])
+            curr_bad = sum(1 for r in role_map.values() if r in EVIL_SPECIAL)
             needed = target_bad - curr_bad
             if needed > 0:
                 p_mins = st.multiselect(f"👿 还需 {needed} 个爪牙", pool, max_selections=needed)
@@ -213,74 +285,71 @@ with tab_input:
             
             if st.button("💾 提交", type="primary", use_container_width=True):
                 # 简单校验
-                bad_cnt = sum(1 for r in role_map.values() if r in ["Assassin", "Morgana", "Mordred", "Oberon", "Minion"])
+                bad_cnt = sum(1 for r in role_map.values() if r in BAD_ROLES)
                 if bad_cnt != target_bad:
                     st.error(f"坏人数量错误：当前{bad_cnt}，应为{target_bad}")
                 elif len(role_map) != num_players:
                     st.error("人数不符")
                 else:
                     save_game(game_date, winner, assassination, role_map)
-                    st.success("已保存到云端表格！")
-                    time.sleep(1.5)
+                    # toast 跨 rerun 保留，无需 sleep 等用户看到提示
+                    st.toast("已保存到云端表格！", icon="✅")
                     st.rerun()
 
 # === Tab 2 & 3 (保持 V8 逻辑，只需确保 df 来源正确) ===
 with tab_history:
-    df = load_games()
     if df.empty:
         st.info("暂无数据")
     else:
         view = st.radio("View", ["📱 卡片", "🖥️ 表格"], horizontal=True, label_visibility="collapsed")
         if "卡片" in view:
-            for i, row in df.sort_values(by="game_date", ascending=False).iterrows():
-                try: roles = json.loads(row['roles'])
-                except: continue
-                with st.container(border=True):
-                    c1, c2 = st.columns([2, 1])
-                    wt = "🔴 红胜" if "红方" in row['winner'] else "🔵 蓝胜"
-                    c1.markdown(f"**{row['game_date']}**")
-                    c2.markdown(f"**{wt}**")
-                    if row['assassination_success']: st.caption("🗡️ 刺梅成功")
-                    st.divider()
-                    bl, rl = [], []
-                    for p, r in roles.items():
-                        line = f"{ROLE_DISPLAY.get(r,r)}: {p}"
-                        if r in ["Merlin", "Percival", "Civilian"]: bl.append(line)
-                        else: rl.append(line)
-                    cb, cr = st.columns(2)
-                    with cb: 
-                        st.markdown(":blue[**蓝方**]")
-                        for l in bl: st.markdown(l)
-                    with cr: 
-                        st.markdown(":red[**红方**]")
-                        for l in rl: st.markdown(l)
+            # 整个列表作为一个 dataframe 发给前端，而不是每局一组 markdown 元素
+            long = explode_roles(df)
+            lines = long["RoleKey"].map(ROLE_DISPLAY).fillna(long["RoleKey"]) + ": " + long["Player"]
+            side = long["RoleKey"].isin(BLUE_ROLES).map({True: "蓝方阵营", False: "红方阵营"})
+            # 每格是列表而不是换行拼接的字符串：dataframe 行高只有一行，多行文本会被截断
+            camps = (lines.groupby([long.index, side]).agg(list)
+                     .unstack().reindex(columns=["蓝方阵营", "红方阵营"]))
+            # 只有一方角色的局，另一方补成空列表
+            camps = camps.map(lambda v: v if isinstance(v, list) else [])
+            # inner join：角色解析失败的局不显示
+            cards = pd.DataFrame({
+                "日期": df["game_date"],
+                "胜方": df["winner"].str.contains("红方", regex=False).map({True: "🔴 红胜", False: "🔵 蓝胜"}),
+                "刺杀": df["assassination_success"].map({True: "🗡️ 刺梅成功", False: ""}),
+            }).join(camps, how="inner")
+            st.dataframe(
+                cards, use_container_width=True, hide_index=True,
+                column_config={
+                    "蓝方阵营": st.column_config.ListColumn(width="medium"),
+                    "红方阵营": st.column_config.ListColumn(width="medium"),
+                },
+            )
         else:
             # 表格视图
-            td = []
             cols = ["梅林", "派西维尔", "忠臣", "刺客", "莫甘娜", "莫德雷德", "奥博伦", "爪牙"]
-            for i, row in df.sort_values(by="game_date", ascending=False).iterrows():
-                roles = json.loads(row['roles'])
-                d = {"日期": row['game_date'], "胜方": row['winner'], "刺杀": "✅" if row['assassination_success'] else ""}
-                grps = {k:[] for k in cols}
-                for p, r in roles.items():
-                    cn = ROLE_DISPLAY.get(r,r).split(" ")[-1]
-                    if cn in grps: grps[cn].append(p)
-                for k,v in grps.items(): d[k]=", ".join(v)
-                td.append(d)
-            st.dataframe(pd.DataFrame(td).fillna("-"), use_container_width=True, hide_index=True)
+            long = explode_roles(df)
+            # 按 (局, 角色) 拼接玩家名，再把角色展开成列
+            grid = (long.assign(role_cn=long["RoleKey"].map(ROLE_TO_CN))
+                    .groupby([long.index, "role_cn"])["Player"].agg(", ".join)
+                    .unstack("role_cn").reindex(columns=cols))
+            td = pd.DataFrame({
+                "日期": df["game_date"], "胜方": df["winner"],
+                "刺杀": df["assassination_success"].map({True: "✅", False: ""}),
+            }).join(grid)
+            st.dataframe(td.fillna(""), use_container_width=True, hide_index=True)
 
 with tab_stats:
-    df = load_games()
     if not df.empty:
-        fd = []
-        for i, row in df.iterrows():
-            roles = json.loads(row['roles'])
-            is_r_win = "红方" in row['winner']
-            for p, r in roles.items():
-                is_blue = r in ["Merlin", "Percival", "Civilian"]
-                win = (is_blue and not is_r_win) or (not is_blue and is_r_win)
-                fd.append({"Player":p, "Role":ROLE_DISPLAY.get(r,r), "Win":1 if win else 0})
-        sdf = pd.DataFrame(fd)
+        long = explode_roles(df)
+        is_r_win = df['winner'].str.contains("红方", regex=False).reindex(long.index)
+        is_blue = long['RoleKey'].isin(BLUE_ROLES)
+        # 蓝方角色蓝胜时赢，红方角色红胜时赢
+        sdf = pd.DataFrame({
+            "Player": long['Player'],
+            "Role": long['RoleKey'].map(ROLE_DISPLAY).fillna(long['RoleKey']),
+            "Win": (is_blue != is_r_win).astype(int),
+        })
         
         st.subheader("🏆 胜率天梯")
         rk = sdf.groupby("Player").agg(场次=("Win","count"), 胜场=("Win","sum"))
@@ -289,7 +358,7 @@ with tab_stats:
         
         st.divider()
         st.subheader("👤 个人详情")
-        user = st.selectbox("选择", get_all_players())
+        user = st.selectbox("选择", current_players)
         if user:
             ud = sdf[sdf["Player"]==user]
             if not ud.empty: